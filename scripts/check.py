@@ -6,26 +6,29 @@ Runs both locally and in GitHub Actions.
 
 import os
 import sys
-import json
-import subprocess
+import http.client
+
+from _gcp_http import authed_get, get_access_token, json_loads
 
 
 def load_credentials():
     key_file = "sa-key.json"
     if os.path.exists(key_file):
-        with open(key_file) as f:
-            return json.load(f)
+        with open(key_file, "rb") as f:
+            return json_loads(f.read())
     elif "GCP_SA_KEY" in os.environ:
-        return json.loads(os.environ["GCP_SA_KEY"])
+        return json_loads(os.environ["GCP_SA_KEY"])
     return None
 
 
 def check_structure():
     print("Checking repo structure...")
     required = ["terraform", "helm", "scripts"]
+    with os.scandir(".") as entries:
+        dirs = {e.name for e in entries if e.is_dir()}
     ok = True
     for d in required:
-        if os.path.isdir(d):
+        if d in dirs:
             print(f"  ✅ {d}/")
         else:
             print(f"  ❌ {d}/ missing")
@@ -33,30 +36,24 @@ def check_structure():
     return ok
 
 
-def check_apigee_api(project_id):
+def check_apigee_api(project_id, sa_info=None):
     print(f"\nChecking Apigee API for project: {project_id}")
-    token_result = subprocess.run(
-        "gcloud auth print-access-token",
-        shell=True, capture_output=True, text=True
-    )
-    if token_result.returncode != 0:
+    token = get_access_token(sa_info)
+    if not token:
         print("  ⚠️  No gcloud token available, skipping Apigee API check.")
         return
 
-    token = token_result.stdout.strip()
     url = f"https://apigee.googleapis.com/v1/organizations/{project_id}"
-    result = subprocess.run(
-        f"curl -s -o /tmp/apigee_resp.json -w '%{{http_code}}' "
-        f"-H 'Authorization: Bearer {token}' {url}",
-        shell=True, capture_output=True, text=True
-    )
-    http_code = result.stdout.strip()
-
-    if http_code == "200":
-        with open("/tmp/apigee_resp.json") as f:
-            data = json.load(f)
+    try:
+        http_code, body = authed_get(url, sa_info)
+    except (http.client.HTTPException, OSError) as e:
+        print(f"  ⚠️  Apigee API unreachable ({e}) — skipping check.")
+        return
+
+    if http_code == 200:
+        data = json_loads(body)
         print(f"  ✅ Apigee org found: {data.get('name', project_id)}")
-    elif http_code == "404":
+    elif http_code == 404:
         print("  ℹ️  No Apigee org found for this project (not yet provisioned — skipping).")
     else:
         print(f"  ⚠️  Apigee API returned HTTP {http_code} — skipping check.")
@@ -68,7 +65,7 @@ def main():
 
     creds = load_credentials()
     if creds:
-        check_apigee_api(creds["project_id"])
+        check_apigee_api(creds["project_id"], sa_info=creds)
     else:
         print("\n⚠️  No credentials found, skipping Apigee API check.")
 
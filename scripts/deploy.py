@@ -5,22 +5,65 @@ deploy.py - Runs Terraform and Helm. Works locally and in GitHub Actions.
 Credential resolution:
   Local (key file):   sa-key.json present → GOOGLE_APPLICATION_CREDENTIALS
   Local (WIF/ADC):    GCP_SA_EMAIL set → GOOGLE_IMPERSONATE_SERVICE_ACCOUNT via ADC
-  CI (key file):      GCP_SA_KEY env var (JSON string) → written to temp file
+  CI (key file):      GCP_SA_KEY env var (JSON string) → written to temp file (/dev/shm if present)
   CI (WIF):           Already authenticated by google-github-actions/auth step
 
 GCP_PROJECT_ID must always be set (env var or extracted from key JSON).
+TF_PARALLELISM overrides Terraform's graph-walk concurrency (default 30).
+VERIFY_ACCESS=1 adds a gcloud pre-flight access check before Terraform.
 """
 
-import json
 import os
+import shlex
 import subprocess
 import sys
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
+from _gcp_http import json_loads
 
-def run(cmd, env=None):
-    print(f"  $ {cmd}")
-    subprocess.run(cmd, shell=True, check=True, env=env or os.environ.copy())
+
+# Plan is bound by GCP API round-trips, not CPU — walk more graph nodes at once.
+TF_PARALLELISM = os.environ.get("TF_PARALLELISM", "30")
+
+
+def run(cmd, env=None, capture=False):
+    """Runs `cmd` (str or argv list) without a shell.
+
+    With capture=True the echoed command and its combined output are returned
+    instead of streamed, so steps running concurrently don't interleave.
+    """
+    if isinstance(cmd, str):
+        cmd = shlex.split(cmd)
+    line = f"  $ {shlex.join(cmd)}"
+    env = env or os.environ.copy()
+    if not capture:
+        print(line)
+        subprocess.run(cmd, check=True, env=env)
+        return None
+    result = subprocess.run(cmd, env=env, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT, text=True)
+    output = f"{line}\n{result.stdout}".rstrip()
+    if result.returncode != 0:
+        raise subprocess.CalledProcessError(result.returncode, cmd, output=output)
+    return output
+
+
+def report(title, future):
+    """Prints the captured output of a background run() under a section header.
+
+    Returns its error (instead of raising) so every step gets reported.
+    """
+    print(f"\n--- {title} ---")
+    try:
+        print(future.result())
+    except subprocess.CalledProcessError as e:
+        print(e.output)
+        return e
+    except OSError as e:  # e.g. binary not installed
+        print(f"  {e}")
+        return e
+    return None
 
 
 def setup_credentials():
@@ -31,17 +74,20 @@ def setup_credentials():
     # Option 1: local sa-key.json
     if os.path.exists("sa-key.json"):
         print("Auth: using local sa-key.json")
-        with open("sa-key.json") as f:
-            creds = json.load(f)
+        with open("sa-key.json", "rb") as f:
+            creds = json_loads(f.read())
         env["GOOGLE_APPLICATION_CREDENTIALS"] = os.path.abspath("sa-key.json")
         env.setdefault("GCP_PROJECT_ID", creds["project_id"])
 
     # Option 2: CI GCP_SA_KEY env var (JSON string)
     elif "GCP_SA_KEY" in os.environ:
         print("Auth: using GCP_SA_KEY env var (key file mode)")
-        creds = json.loads(os.environ["GCP_SA_KEY"])
-        tmp = tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False)
-        json.dump(creds, tmp)
+        key_json = os.environ["GCP_SA_KEY"]
+        creds = json_loads(key_json)
+        # Terraform needs a path; keep the key in RAM (tmpfs) where available
+        tmp_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+        tmp = tempfile.NamedTemporaryFile(mode='w', suffix='.json', dir=tmp_dir, delete=False)
+        tmp.write(key_json)
         tmp.close()
         tmp_key_path = tmp.name
         env["GOOGLE_APPLICATION_CREDENTIALS"] = tmp_key_path
@@ -74,25 +120,40 @@ def main():
     env["GCP_PROJECT_ID"] = project_id
     env["GOOGLE_PROJECT"] = project_id
 
+    # Reuse provider binaries across runs (CI caches this dir, keyed on the lock file)
+    env.setdefault("TF_PLUGIN_CACHE_DIR", os.path.expanduser("~/.terraform.d/plugin-cache"))
+    os.makedirs(env["TF_PLUGIN_CACHE_DIR"], exist_ok=True)
+
     print(f"Project ID: {project_id}")
 
     try:
-        # Validate GCP access
-        print("\n--- GCP Access Validation ---")
-        run(f"gcloud projects describe {project_id} --format='value(name)'", env=env)
+        # Validate GCP access (opt-in — terraform plan surfaces auth errors itself)
+        if os.environ.get("VERIFY_ACCESS"):
+            print("\n--- GCP Access Validation ---")
+            run(f"gcloud projects describe {project_id} --format='value(name)'", env=env)
 
         # Terraform (plan only)
         print("\n--- Terraform ---")
-        run("terraform -chdir=terraform init", env=env)
-        run(f"terraform -chdir=terraform plan -var='project_id={project_id}'", env=env)
-
-        # Helm (template only — no cluster needed)
-        print("\n--- Helm ---")
-        run(f"helm template minimal-demo ./helm --set projectId={project_id}")
-
-        # Structural + Apigee API check
-        print("\n--- Checks ---")
-        run("python3 scripts/check.py", env=env)
+        run("terraform -chdir=terraform init -input=false -upgrade=false", env=env)
+
+        # Helm render and checks don't depend on Terraform — run them alongside plan.
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            # Helm (template only — no cluster needed)
+            helm = pool.submit(
+                run, f"helm template minimal-demo ./helm --set projectId={project_id}", capture=True)
+            # Structural + Apigee API check
+            checks = pool.submit(run, "python3 scripts/check.py", env=env, capture=True)
+
+            try:
+                run(f"terraform -chdir=terraform plan -parallelism={TF_PARALLELISM} "
+                    f"-var='project_id={project_id}'", env=env)
+            finally:
+                # Always show helm/check output; a plan error re-raises after this.
+                errors = [report("Helm", helm), report("Checks", checks)]
+
+        failed = next((e for e in errors if e), None)
+        if failed:
+            raise failed
 
     finally:
         if tmp_key_path:
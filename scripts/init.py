@@ -11,7 +11,7 @@ Usage:
 Project ID resolution (in order):
   1. CLI positional argument
   2. Existing sa-key.json (idempotent re-run)
-  3. Auto-generated: min-cicd-sample-<random6chars>
+  3. Auto-generated: min-cicd-sample-<6 hex chars>
 
 --billing-account is required when creating a new project.
 --github-repo defaults to krisrowe/minimal-cicd-sample (used for WIF fallback).
@@ -20,28 +20,83 @@ Project ID resolution (in order):
 import argparse
 import json
 import os
-import random
-import string
+import re
+import secrets
+import shlex
 import subprocess
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 
 GITHUB_REPO_DEFAULT = "krisrowe/minimal-cicd-sample"
 POOL_ID = "github-pool"
 PROVIDER_ID = "github-provider"
 KEY_FILE = "sa-key.json"
+APIS = ("cloudresourcemanager.googleapis.com iamcredentials.googleapis.com "
+        "orgpolicy.googleapis.com compute.googleapis.com apigee.googleapis.com")
 
 
-def run(cmd, check=True, capture=False):
-    kwargs = dict(shell=True, check=check)
+def argv(cmd):
+    """Splits a command string into an argv list (lists pass through) — no shell involved."""
+    return shlex.split(cmd) if isinstance(cmd, str) else cmd
+
+
+def run(cmd, check=True, capture=False, stdin=None):
+    """Runs `cmd`; with capture=True returns its stdout.
+
+    Only stdout is captured — stderr (gcloud progress and errors) streams to the
+    console as it happens instead of being buffered until exit.
+    """
+    kwargs = dict(check=check, stdin=stdin)
     if capture:
-        kwargs.update(capture_output=True, text=True)
-    result = subprocess.run(cmd, **kwargs)
+        kwargs.update(stdout=subprocess.PIPE, text=True)
+    result = subprocess.run(argv(cmd), **kwargs)
     return result.stdout.strip() if capture else None
 
 
+# Describe commands that have succeeded in this process. Only hits are remembered:
+# nothing here deletes resources, but a miss may be created moments later.
+_found = set()
+
+
+def _exists_uncached(cmd):
+    return subprocess.run(argv(cmd), capture_output=True).returncode == 0
+
+
 def exists(cmd):
-    return subprocess.run(cmd, shell=True, capture_output=True).returncode == 0
+    """Memoized by command string for positive results only — misses are always re-checked."""
+    if cmd in _found:
+        return True
+    if _exists_uncached(cmd):
+        _found.add(cmd)
+        return True
+    return False
+
+
+def exists_all(checks):
+    """Runs independent read-only `exists` checks concurrently. Returns {name: bool}."""
+    with ThreadPoolExecutor(max_workers=len(checks)) as pool:
+        futures = {name: pool.submit(exists, cmd) for name, cmd in checks.items()}
+        return {name: f.result() for name, f in futures.items()}
+
+
+def enable_apis_async(project_id):
+    """Starts enabling APIS without waiting. Returns the operation name to wait on,
+    or None if enablement had to fall back to a synchronous (already finished) call.
+    """
+    result = subprocess.run(argv(f"gcloud services enable {APIS} --async --project {project_id}"),
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        print(result.stderr, file=sys.stderr)
+        raise subprocess.CalledProcessError(result.returncode, result.args, result.stdout, result.stderr)
+    # --async returns no resource; gcloud names the operation in its stderr status message.
+    match = re.search(r"operations/[\w.\-]+", result.stdout + result.stderr)
+    if match:
+        return match.group(0)
+    print("  ⚠️  gcloud started async API enablement but reported no operation name — "
+          "enabling synchronously instead.")
+    run(f"gcloud services enable {APIS} --project {project_id}")
+    return None
 
 
 def resolve_project_id(args):
@@ -55,18 +110,22 @@ def resolve_project_id(args):
         if project_id:
             print(f"Using project ID from existing {KEY_FILE}: {project_id}")
             return project_id
-    suffix = ''.join(random.choices(string.ascii_lowercase + string.digits, k=6))
+    suffix = secrets.token_hex(3)
     project_id = f"min-cicd-sample-{suffix}"
     print(f"Auto-generated project ID: {project_id}")
     return project_id
 
 
-def setup_wif(project_id, sa_email, github_repo):
-    """Set up Workload Identity Federation as fallback when key creation is blocked."""
+def setup_wif(project_id, sa_email, github_repo, found, num_future):
+    """Set up Workload Identity Federation as fallback when key creation is blocked.
+
+    `found` holds the prefetched existence checks from main() ("pool", "provider");
+    `num_future` resolves to the project number.
+    """
     print("\n  Falling back to Workload Identity Federation (keyless)...")
 
     # Create WIF pool (idempotent)
-    if exists(f"gcloud iam workload-identity-pools describe {POOL_ID} --location=global --project {project_id}"):
+    if found["pool"]:
         print(f"  ✅ WIF Pool '{POOL_ID}' already exists.")
     else:
         print(f"  Creating WIF Pool '{POOL_ID}'...")
@@ -74,8 +133,7 @@ def setup_wif(project_id, sa_email, github_repo):
             f'--location=global --display-name="GitHub Actions Pool" --project {project_id}')
 
     # Create WIF provider (idempotent)
-    if exists(f"gcloud iam workload-identity-pools providers describe {PROVIDER_ID} "
-              f"--workload-identity-pool={POOL_ID} --location=global --project {project_id}"):
+    if found["provider"]:
         print(f"  ✅ WIF Provider '{PROVIDER_ID}' already exists.")
     else:
         print(f"  Creating WIF Provider '{PROVIDER_ID}'...")
@@ -88,25 +146,26 @@ def setup_wif(project_id, sa_email, github_repo):
 
     # Grant SA impersonation
     print("  Granting SA impersonation to WIF provider...")
-    project_number = run(
-        f"gcloud projects describe {project_id} --format='value(projectNumber)'", capture=True)
+    project_number = num_future.result()
     wif_member = (f"principalSet://iam.googleapis.com/projects/{project_number}"
                   f"/locations/global/workloadIdentityPools/{POOL_ID}"
                   f"/attribute.repository/{github_repo}")
     run(f"gcloud iam service-accounts add-iam-policy-binding {sa_email} "
         f"--role='roles/iam.workloadIdentityUser' --member='{wif_member}' --project {project_id}")
 
-    # Get full provider resource name
-    full_provider = run(
-        f"gcloud iam workload-identity-pools providers describe {PROVIDER_ID} "
-        f"--workload-identity-pool={POOL_ID} --location=global --project {project_id} "
-        f"--format='value(name)'", capture=True)
+    # Full provider resource name is deterministic — no need for another describe
+    full_provider = (f"projects/{project_number}/locations/global"
+                     f"/workloadIdentityPools/{POOL_ID}/providers/{PROVIDER_ID}")
 
-    # Push WIF secrets to GitHub
+    # Push WIF secrets to GitHub (independent — set them concurrently)
     print("  Pushing WIF secrets to GitHub...")
-    run(f"gh secret set WIF_PROVIDER --body '{full_provider}'")
-    run(f"gh secret set WIF_SA_EMAIL --body '{sa_email}'")
-    run(f"gh secret set GCP_PROJECT_ID --body '{project_id}'")
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        futures = [pool.submit(run, f"gh secret set {name} --body '{value}'")
+                   for name, value in (("WIF_PROVIDER", full_provider),
+                                       ("WIF_SA_EMAIL", sa_email),
+                                       ("GCP_PROJECT_ID", project_id))]
+        for f in futures:
+            f.result()
     print("  ✅ WIF setup complete. GitHub secrets: WIF_PROVIDER, WIF_SA_EMAIL, GCP_PROJECT_ID")
 
 
@@ -125,8 +184,19 @@ def main():
 
     print(f"\nInitializing project: {project_id}")
 
+    # Idempotency checks are independent read-only RPCs — fan them out up-front.
+    # Nothing below creates a pool or provider before setup_wif() reads them.
+    found = exists_all({
+        "project": f"gcloud projects describe {project_id}",
+        "sa": f"gcloud iam service-accounts describe {sa_email} --project {project_id}",
+        "pool": f"gcloud iam workload-identity-pools describe {POOL_ID} "
+                f"--location=global --project {project_id}",
+        "provider": f"gcloud iam workload-identity-pools providers describe {PROVIDER_ID} "
+                    f"--workload-identity-pool={POOL_ID} --location=global --project {project_id}",
+    })
+
     # 1. Create project (idempotent)
-    if exists(f"gcloud projects describe {project_id}"):
+    if found["project"]:
         print("  ✅ Project already exists, skipping creation.")
     else:
         if not args.billing_account:
@@ -136,62 +206,81 @@ def main():
         print(f"  Creating project {project_id}...")
         run(f'gcloud projects create {project_id} --name="Minimal CICD Demo"')
 
-    # 2. Link billing (if provided)
-    if args.billing_account:
-        print("  Linking billing account...")
-        run(f"gcloud billing projects link {project_id} --billing-account={args.billing_account}")
-
-    # 3. Reset SA key creation org policy (best-effort — may be blocked by org admin role)
-    print("  Attempting to reset SA key creation policy (best-effort)...")
-    reset_ok = subprocess.run(
-        f"gcloud org-policies reset constraints/iam.disableServiceAccountKeyCreation --project {project_id}",
-        shell=True, capture_output=True
-    ).returncode == 0
-    if reset_ok:
-        print("  ✅ SA key creation policy reset.")
-    else:
-        print("  ⚠️  Could not reset SA key policy — will try key creation anyway, may fall back to WIF.")
-
-    # 4. Enable APIs
-    print("  Enabling APIs...")
-    run(f"gcloud services enable cloudresourcemanager.googleapis.com iamcredentials.googleapis.com "
-        f"orgpolicy.googleapis.com compute.googleapis.com apigee.googleapis.com --project {project_id}")
-
-    # 5. Create SA (idempotent)
-    if exists(f"gcloud iam service-accounts describe {sa_email} --project {project_id}"):
-        print("  ✅ Service account already exists.")
-    else:
-        print(f"  Creating service account {sa_name}...")
-        run(f'gcloud iam service-accounts create {sa_name} --display-name="Deployer SA" --project {project_id}')
-
-    # 6. Grant Owner role
-    print("  Granting Owner role...")
-    run(f"gcloud projects add-iam-policy-binding {project_id} "
-        f"--member='serviceAccount:{sa_email}' --role='roles/owner'")
-
-    # 7. Try SA key export; fall back to WIF if blocked
-    print(f"  Exporting SA key to {KEY_FILE}...")
-    key_result = subprocess.run(
-        f"gcloud iam service-accounts keys create {KEY_FILE} "
-        f"--iam-account={sa_email} --project {project_id}",
-        shell=True, capture_output=True
-    )
-    if key_result.returncode == 0:
-        print(f"  ✅ SA key saved to {KEY_FILE} (gitignored).")
-        # Push key as GitHub secret
-        print("  Pushing GCP_SA_KEY to GitHub...")
-        run(f"gh secret set GCP_SA_KEY < {KEY_FILE}")
-        run(f"gh secret set GCP_PROJECT_ID --body '{project_id}'")
-        print("\n✅ Done (key file mode).")
-        print(f"   {KEY_FILE} saved locally (gitignored).")
-        print(f"   GitHub secrets set: GCP_SA_KEY, GCP_PROJECT_ID")
-    else:
-        print("  ⚠️  Key creation blocked — setting up Workload Identity Federation instead.")
-        setup_wif(project_id, sa_email, github_repo)
-        print("\n✅ Done (WIF mode — no key file).")
-        print("   For local runs: gcloud auth application-default login")
-        print(f"   export GCP_PROJECT_ID={project_id}")
-        print(f"   export GCP_SA_EMAIL={sa_email}")
+    # Project number is only needed by the WIF fallback — fetch it in the background now.
+    # The with-block joins the lookup on every exit path, including errors and sys.exit.
+    with ThreadPoolExecutor(max_workers=1) as background:
+        num_future = background.submit(
+            run, f"gcloud projects describe {project_id} --format='value(projectNumber)'", capture=True)
+
+        # 2. Link billing (if provided, idempotent). A project created above can't be linked
+        #    yet, so only existing projects pay for the describe.
+        if args.billing_account:
+            current = ""
+            if found["project"]:
+                current = run(f"gcloud billing projects describe {project_id} "
+                              f"--format='value(billingAccountName)'", check=False, capture=True)
+            if current.split("/")[-1] == args.billing_account:
+                print("  ✅ Billing account already linked.")
+            else:
+                print("  Linking billing account...")
+                run(f"gcloud billing projects link {project_id} --billing-account={args.billing_account}")
+
+        # 3. Reset SA key creation org policy (best-effort — may be blocked by org admin role)
+        print("  Attempting to reset SA key creation policy (best-effort)...")
+        reset_ok = subprocess.run(
+            argv(f"gcloud org-policies reset constraints/iam.disableServiceAccountKeyCreation --project {project_id}"),
+            capture_output=True
+        ).returncode == 0
+        if reset_ok:
+            print("  ✅ SA key creation policy reset.")
+        else:
+            print("  ⚠️  Could not reset SA key policy — will try key creation anyway, may fall back to WIF.")
+
+        # 4. Enable APIs (async — propagation overlaps with SA setup, awaited before step 7)
+        print("  Enabling APIs...")
+        enable_op = enable_apis_async(project_id)
+
+        # 5. Create SA (idempotent)
+        if found["sa"]:
+            print("  ✅ Service account already exists.")
+        else:
+            print(f"  Creating service account {sa_name}...")
+            run(f'gcloud iam service-accounts create {sa_name} --display-name="Deployer SA" --project {project_id}')
+
+        # 6. Grant Owner role
+        print("  Granting Owner role...")
+        run(f"gcloud projects add-iam-policy-binding {project_id} "
+            f"--member='serviceAccount:{sa_email}' --role='roles/owner'")
+
+        # Key export and WIF setup need the APIs from step 4 to be live.
+        if enable_op:
+            print("  Waiting for API enablement to finish...")
+            run(f"gcloud services operations wait {enable_op}")
+
+        # 7. Try SA key export; fall back to WIF if blocked
+        print(f"  Exporting SA key to {KEY_FILE}...")
+        key_result = subprocess.run(
+            argv(f"gcloud iam service-accounts keys create {KEY_FILE} "
+                 f"--iam-account={sa_email} --project {project_id}"),
+            capture_output=True
+        )
+        if key_result.returncode == 0:
+            print(f"  ✅ SA key saved to {KEY_FILE} (gitignored).")
+            # Push key as GitHub secret
+            print("  Pushing GCP_SA_KEY to GitHub...")
+            with open(KEY_FILE, "rb") as key:
+                run("gh secret set GCP_SA_KEY", stdin=key)
+            run(f"gh secret set GCP_PROJECT_ID --body '{project_id}'")
+            print("\n✅ Done (key file mode).")
+            print(f"   {KEY_FILE} saved locally (gitignored).")
+            print(f"   GitHub secrets set: GCP_SA_KEY, GCP_PROJECT_ID")
+        else:
+            print("  ⚠️  Key creation blocked — setting up Workload Identity Federation instead.")
+            setup_wif(project_id, sa_email, github_repo, found, num_future)
+            print("\n✅ Done (WIF mode — no key file).")
+            print("   For local runs: gcloud auth application-default login")
+            print(f"   export GCP_PROJECT_ID={project_id}")
+            print(f"   export GCP_SA_EMAIL={sa_email}")
 
 
 if __name__ == "__main__":